@@ -5,19 +5,271 @@ A powerful terminal management system with inter-terminal communication,
 remote command execution, and customizable shortcuts.
 """
 
+from __future__ import annotations
+
 import os
 import sys
 import json
-import time
-import signal
-import subprocess
 import threading
 import queue
+import collections
 import socket
 import select
+import struct
+import shlex
+import itertools
+import string
+import base64
 from pathlib import Path
-from typing import Dict, List, Optional, Callable
-import argparse
+from typing import List, Optional, Callable, Iterator, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import asyncio
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Every wire message starts with a 1-byte codec tag so peers with and
+# without msgpack installed can still talk to each other.
+WIRE_JSON = 1
+WIRE_MSGPACK = 2
+WIRE_DEFAULT = WIRE_MSGPACK if msgpack else WIRE_JSON
+
+# Compact encoder reused for all JSON wire traffic
+_ENC = json.JSONEncoder(separators=(',', ':')).encode
+
+# Pre-serialized prefix of {'type': 'message', 'content': ...}, the
+# most common message relayed by the server
+_TEXT_MESSAGE_JSON = bytes((WIRE_JSON,)) + b'{"type":"message","content":'
+if msgpack:
+    _TEXT_MESSAGE_MSGPACK = (
+        bytes((WIRE_MSGPACK, 0x82)) +
+        msgpack.packb('type') + msgpack.packb('message') + msgpack.packb('content')
+    )
+
+# Pre-serialized prefix of the {'status': 'registered', 'name': ...} reply
+_REG_PREFIX_JSON = bytes((WIRE_JSON,)) + b'{"status":"registered","name":'
+_REG_SUFFIX_JSON = b'}'
+if msgpack:
+    _REG_PREFIX_MSGPACK = (
+        bytes((WIRE_MSGPACK, 0x82)) +
+        msgpack.packb('status') + msgpack.packb('registered') + msgpack.packb('name')
+    )
+
+# Control messages are tiny JSON payloads; disable Nagle so every
+# request/response is flushed immediately instead of waiting ~40ms.
+# Buffers are raised so command output of tens of KB fits in one go.
+SOCKET_BUFFER_SIZE = 262144
+DEFAULT_SOCKET_OPTIONS = [
+    (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+    (socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE),
+    (socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE),
+]
+
+# Completion callbacks bound for the same terminal within this window (in
+# seconds) are delivered together as a single 'batch' message
+CALLBACK_BATCH_WINDOW = 0.002
+
+def _apply_socket_options(sock: socket.socket, options=None):
+    """Apply (level, option, value) tuples to a socket"""
+    for level, option, value in (DEFAULT_SOCKET_OPTIONS if options is None else options):
+        sock.setsockopt(level, option, value)
+
+def _encode_message(message: dict, codec: int = WIRE_DEFAULT) -> bytes:
+    """Serialize a message, prefixed with its codec tag"""
+    if codec == WIRE_MSGPACK and msgpack:
+        return bytes((WIRE_MSGPACK,)) + msgpack.packb(message, use_bin_type=True)
+    return bytes((WIRE_JSON,)) + _ENC(message).encode()
+
+def _encode_text_message(content, codec: int = WIRE_DEFAULT) -> bytes:
+    """Serialize a 'message' message without building the dict"""
+    if codec == WIRE_MSGPACK and msgpack:
+        return _TEXT_MESSAGE_MSGPACK + msgpack.packb(content, use_bin_type=True)
+    return _TEXT_MESSAGE_JSON + _ENC(content).encode() + b'}'
+
+def _encode_registered(name: str, codec: int = WIRE_DEFAULT) -> bytes:
+    """Serialize the register reply without building the dict"""
+    if codec == WIRE_MSGPACK and msgpack:
+        return _REG_PREFIX_MSGPACK + msgpack.packb(name)
+    return _REG_PREFIX_JSON + _ENC(name).encode() + _REG_SUFFIX_JSON
+
+def _decode_message(data: bytes):
+    """Deserialize a tagged message, returning (message, codec)"""
+    if not data:
+        raise ValueError("Empty wire message")
+    codec = data[0]
+    if codec == WIRE_MSGPACK:
+        if not msgpack:
+            raise ValueError("Received msgpack message but msgpack is not installed")
+        return msgpack.unpackb(data[1:], raw=False), codec
+    if codec == WIRE_JSON:
+        return json.loads(data[1:].decode()), codec
+    raise ValueError(f"Unknown wire codec: {codec}")
+
+# Frame header: payload length as a 4-byte big-endian integer
+_HEADER = struct.Struct('>I')
+_RECV_SIZE = 65536
+
+def _send_frame(sock: socket.socket, payload: bytes):
+    """Send a payload prefixed with its 4-byte big-endian length
+    
+    Header and payload are gather-written with sendmsg where available,
+    so large payloads are not copied just to prepend four bytes.
+    """
+    header = _HEADER.pack(len(payload))
+    if not hasattr(sock, 'sendmsg'):
+        sock.sendall(header + payload)
+        return
+    
+    sent = sock.sendmsg([header, payload])
+    if sent == len(header) + len(payload):
+        return
+    # Partial write: cork so the remainder leaves in full segments
+    cork = hasattr(socket, 'TCP_CORK') and sock.family in (socket.AF_INET, socket.AF_INET6)
+    if cork:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+    try:
+        if sent < len(header):
+            sock.sendall(header[sent:])
+            sock.sendall(payload)
+        else:
+            sock.sendall(memoryview(payload)[sent - len(header):])
+    finally:
+        if cork:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+
+def _split_frames(buffer: bytearray) -> List[bytes]:
+    """Remove and return every complete length-prefixed payload in buffer
+    
+    Frames are sliced out by offset and the consumed prefix is dropped
+    once, so a read that carries many small messages costs a single
+    buffer shift.
+    """
+    frames = []
+    offset = 0
+    available = len(buffer)
+    while available - offset >= _HEADER.size:
+        end = offset + _HEADER.size + _HEADER.unpack_from(buffer, offset)[0]
+        if end > available:
+            break
+        frames.append(bytes(buffer[offset + _HEADER.size:end]))
+        offset = end
+    if offset:
+        del buffer[:offset]
+    return frames
+
+def _read_frames(sock: socket.socket) -> Iterator[bytes]:
+    """Yield payloads from a blocking socket until the peer closes"""
+    buffer = bytearray()
+    while True:
+        chunk = sock.recv(_RECV_SIZE)
+        if not chunk:
+            return
+        buffer += chunk
+        yield from _split_frames(buffer)
+
+class ShardedDict:
+    """Dict split into lock-guarded shards to keep writers from contending
+    
+    Reads are lock-free; each write only takes the lock of its key's shard.
+    """
+    
+    def __init__(self, shards: int = 16):
+        if shards & (shards - 1):
+            raise ValueError("shards must be a power of two")
+        self._mask = shards - 1
+        self._shards = [{} for _ in range(shards)]
+        self._locks = [threading.Lock() for _ in range(shards)]
+    
+    def get(self, key, default=None):
+        return self._shards[hash(key) & self._mask].get(key, default)
+    
+    def __contains__(self, key) -> bool:
+        return key in self._shards[hash(key) & self._mask]
+    
+    def __setitem__(self, key, value):
+        index = hash(key) & self._mask
+        with self._locks[index]:
+            self._shards[index][key] = value
+    
+    def pop(self, key, default=None):
+        index = hash(key) & self._mask
+        with self._locks[index]:
+            return self._shards[index].pop(key, default)
+    
+    def pop_if(self, key, predicate: Callable) -> bool:
+        """Remove key only if predicate(value) holds, atomically"""
+        index = hash(key) & self._mask
+        with self._locks[index]:
+            shard = self._shards[index]
+            if key in shard and predicate(shard[key]):
+                del shard[key]
+                return True
+        return False
+    
+    def keys(self) -> list:
+        """Snapshot the keys of every shard"""
+        keys = []
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                keys.extend(shard)
+        return keys
+
+# Characters that a shell interprets differently from shlex; commands
+# containing them are run through /bin/sh instead of being split into
+# argv. '#' starts a comment, '=' may be a leading variable assignment
+# and backslashes are escaped differently inside double quotes.
+_SHELL_CHARS = frozenset('|&;<>()$`*?[]{}~#=\\\n')
+
+def _command_args(command: str) -> List[str]:
+    """Build the argv for a command, avoiding a shell when possible"""
+    if _SHELL_CHARS.intersection(command):
+        return ['/bin/sh', '-c', command]
+    try:
+        args = shlex.split(command, comments=True)
+    except ValueError:
+        args = []
+    return args or ['/bin/sh', '-c', command]
+
+def _encode_output(*outputs: bytes):
+    """Encode raw command output for the wire, returning (texts, encoding)
+    
+    Output that is valid UTF-8 is sent as text; anything else is sent as
+    base64 so binary output survives the round trip.
+    """
+    try:
+        return [data.decode('utf-8') for data in outputs], 'utf8'
+    except UnicodeDecodeError:
+        return [base64.b64encode(data).decode('ascii') for data in outputs], 'b64'
+
+def _decode_output(text: str, encoding: Optional[str]) -> str:
+    """Turn output received from another terminal into printable text"""
+    if encoding == 'b64':
+        return base64.b64decode(text).decode('utf-8', errors='replace')
+    return text
+
+def _echo_output(data: bytes):
+    """Write raw command output to stdout without decoding it"""
+    buffer = getattr(sys.stdout, 'buffer', None)
+    if buffer is None:
+        print(data.decode(errors='replace'), end='')
+        return
+    sys.stdout.flush()
+    buffer.write(data)
+    buffer.flush()
+
+def _available_cpus() -> List[int]:
+    """CPUs this process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
 
 class PipelineConfig:
     """Configuration management for Pipeline"""
@@ -31,138 +283,307 @@ class PipelineConfig:
     def ensure_config_dir(self):
         self.config_dir.mkdir(exist_ok=True)
         
+    def _read_json(self, path: Path) -> dict:
+        with open(path, 'rb') as f:
+            data = f.read()
+        return orjson.loads(data) if orjson else json.loads(data)
+    
+    def _write_json(self, path: Path, data: dict):
+        """Write JSON to a temporary file and atomically move it into place"""
+        if orjson:
+            content = orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+        else:
+            content = json.dumps(data, indent=2).encode()
+        try:
+            mode = path.stat().st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o644
+        import tempfile
+        fd, tmp_path = tempfile.mkstemp(dir=self.config_dir, prefix=f".{path.name}.")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                # mkstemp creates files 0600; keep the target's mode instead
+                os.fchmod(f.fileno(), mode)
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    
     def load_config(self) -> dict:
         if self.config_file.exists():
-            with open(self.config_file, 'r') as f:
-                return json.load(f)
+            return self._read_json(self.config_file)
         return {'terminals': {}, 'port': 9999}
     
     def save_config(self, config: dict):
-        with open(self.config_file, 'w') as f:
-            json.dump(config, f, indent=2)
+        self._write_json(self.config_file, config)
     
     def load_shortcuts(self) -> dict:
         if self.shortcuts_file.exists():
-            with open(self.shortcuts_file, 'r') as f:
-                return json.load(f)
+            return self._read_json(self.shortcuts_file)
         return {}
     
     def save_shortcuts(self, shortcuts: dict):
-        with open(self.shortcuts_file, 'w') as f:
-            json.dump(shortcuts, f, indent=2)
+        self._write_json(self.shortcuts_file, shortcuts)
+    
+    def control_path(self, name: str) -> str:
+        """Path of a terminal's control socket, kept where only we can reach it"""
+        control_dir = self.config_dir / 'control'
+        control_dir.mkdir(mode=0o700, exist_ok=True)
+        return str(control_dir / f"{name}.ctl")
+
+class _Peer:
+    """A client connection served by one of the server's event loops"""
+    
+    def __init__(self, writer: asyncio.StreamWriter, loop: asyncio.AbstractEventLoop):
+        self.writer = writer
+        self.codec = WIRE_JSON
+        self.names = set()
+        self.loop = loop
+        self.thread_id = threading.get_ident()
+    
+    def send(self, payload: bytes):
+        """Queue a length-prefixed payload; safe to call from any thread"""
+        if self.writer.is_closing():
+            raise ConnectionError("Peer disconnected")
+        # writelines lets the transport gather-write header and payload
+        buffers = (_HEADER.pack(len(payload)), payload)
+        if threading.get_ident() == self.thread_id:
+            self.writer.writelines(buffers)
+        else:
+            self.loop.call_soon_threadsafe(self.writer.writelines, buffers)
 
 class TerminalManager:
     """Manages terminal instances and their communication"""
     
-    def __init__(self, name: str, port: int):
+    def __init__(self, name: str, port: int, workers: Optional[int] = None):
         self.name = name
         self.port = port
-        self.terminals = {}
-        self.message_queue = queue.Queue()
-        self.completion_callbacks = {}
+        self.workers = workers
+        self.terminals = ShardedDict()
+        # Bumped whenever the set of terminals changes; keys the list cache
+        self._versions = itertools.count(1)
+        self.terminals_version = 0
+        self._list_cache = {}
+        self._pending_callbacks = {}
+        self._pending_lock = threading.Lock()
+        self.completion_callbacks = ShardedDict()
         self.server_socket = None
+        self.server_sockets = []
+        self._port_lock = None
+        self._loops = []
+        self._peers = set()
         self.running = True
         self.config = PipelineConfig()
+        self._handlers = {
+            'register': self._register_terminal,
+            'send': self._send_to_terminal,
+            'execute': self._execute_command,
+            'complete': self._handle_completion,
+            'stream': self._handle_stream,
+            'list': self._list_terminals
+        }
         
     def start_server(self):
         """Start the communication server"""
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        cpus = _available_cpus()
+        workers = self.workers or len(cpus)
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            workers = 1
+        if not self._lock_port():
+            print(f"Error starting server: a Pipeline server is already running on port {self.port}")
+            return False
         try:
-            self.server_socket.bind(('localhost', self.port))
-            self.server_socket.listen(10)
+            # One listening socket per worker; with SO_REUSEPORT the kernel
+            # spreads incoming connections across them.
+            for _ in range(workers):
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.server_sockets.append(sock)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                if workers > 1:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+                _apply_socket_options(sock)
+                sock.bind(('localhost', self.port))
+                sock.listen(10)
+            self.server_socket = self.server_sockets[0]
             print(f"Pipeline server started on port {self.port}")
-            
-            # Start server thread
-            server_thread = threading.Thread(target=self._handle_connections)
-            server_thread.daemon = True
-            server_thread.start()
-            
         except OSError as e:
             print(f"Error starting server: {e}")
+            for sock in self.server_sockets:
+                sock.close()
+            self.server_sockets = []
+            self._port_lock.close()
+            self._port_lock = None
             return False
         return True
     
-    def _handle_connections(self):
-        """Handle incoming connections"""
-        while self.running:
+    def _lock_port(self) -> bool:
+        """Claim the port for this process, held until it exits
+        
+        SO_REUSEPORT would otherwise let a second server bind the same
+        port and take a share of its connections.
+        """
+        import fcntl
+        lock = open(self.config.config_dir / f'server_{self.port}.lock', 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return False
+        self._port_lock = lock
+        return True
+    
+    def serve_forever(self):
+        """Serve clients until stop() is called or SIGINT arrives
+        
+        The first listening socket is served from the calling thread and
+        every other one from its own thread, each with its own event loop
+        pinned to one CPU.
+        """
+        cpus = _available_cpus()
+        threads = []
+        for index, sock in enumerate(self.server_sockets[1:], start=1):
+            thread = threading.Thread(
+                target=self._serve_in_thread,
+                args=(sock, cpus[index % len(cpus)])
+            )
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        
+        # Only the server needs asyncio, so terminals never pay for
+        # importing it. The default Unix loop is a SelectorEventLoop,
+        # which uses epoll on Linux.
+        import asyncio
+        asyncio.run(self._serve(self.server_socket))
+        self.stop()
+        for thread in threads:
+            thread.join()
+    
+    def stop(self):
+        """Stop every event loop; safe to call from any thread"""
+        self.running = False
+        for loop, stopped in list(self._loops):
             try:
-                ready, _, _ = select.select([self.server_socket], [], [], 1.0)
-                if ready:
-                    client_socket, addr = self.server_socket.accept()
-                    client_thread = threading.Thread(
-                        target=self._handle_client, 
-                        args=(client_socket,)
-                    )
-                    client_thread.daemon = True
-                    client_thread.start()
-            except:
-                break
+                loop.call_soon_threadsafe(stopped.set)
+            except RuntimeError:
+                # Loop already finished
+                pass
     
-    def _handle_client(self, client_socket):
-        """Handle client messages"""
+    def _serve_in_thread(self, sock: socket.socket, cpu: int):
+        """Run one accept loop pinned to a single CPU"""
+        if hasattr(os, 'sched_setaffinity'):
+            try:
+                os.sched_setaffinity(0, {cpu})
+            except OSError:
+                pass
+        import asyncio
+        asyncio.run(self._serve(sock))
+    
+    async def _serve(self, sock: socket.socket):
+        """Accept connections on a bound listening socket"""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        stopped = asyncio.Event()
+        self._loops.append((loop, stopped))
+        try:
+            if not self.running:
+                return
+            if threading.current_thread() is threading.main_thread():
+                import signal
+                loop.add_signal_handler(signal.SIGINT, self.stop)
+            
+            server = await asyncio.start_server(self._handle_client, sock=sock)
+            async with server:
+                await stopped.wait()
+                # Leaving the block waits for every client connection on
+                # Python 3.12.1+, and terminals stay connected for life
+                for peer in list(self._peers):
+                    if peer.loop is loop:
+                        peer.writer.close()
+        finally:
+            self._loops.remove((loop, stopped))
+    
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Read length-prefixed messages from a client until it disconnects"""
+        import asyncio
+        _apply_socket_options(writer.get_extra_info('socket'))
+        peer = _Peer(writer, asyncio.get_running_loop())
+        self._peers.add(peer)
+        buffer = bytearray()
         try:
             while True:
-                data = client_socket.recv(4096)
-                if not data:
+                chunk = await reader.read(_RECV_SIZE)
+                if not chunk:
                     break
-                    
-                message = json.loads(data.decode())
-                self._process_message(message, client_socket)
-        except:
+                buffer += chunk
+                for data in _split_frames(buffer):
+                    try:
+                        message, peer.codec = _decode_message(data)
+                    except ValueError:
+                        continue
+                    self._process_message(message, peer)
+        except (ConnectionError, asyncio.CancelledError):
+            # Cancelled when the server shuts down with clients connected
             pass
         finally:
-            client_socket.close()
+            self._peers.discard(peer)
+            for name in peer.names:
+                self._unregister_terminal(name, peer)
+            writer.close()
+    
+    def _send_message(self, peer: _Peer, message: dict):
+        """Send a message using the codec the peer last spoke"""
+        peer.send(_encode_message(message, peer.codec))
     
-    def _process_message(self, message: dict, client_socket):
+    def _process_message(self, message: dict, peer):
         """Process incoming messages"""
-        msg_type = message.get('type')
-        
-        if msg_type == 'register':
-            self._register_terminal(message, client_socket)
-        elif msg_type == 'send':
-            self._send_to_terminal(message)
-        elif msg_type == 'execute':
-            self._execute_command(message)
-        elif msg_type == 'complete':
-            self._handle_completion(message)
-        elif msg_type == 'list':
-            self._list_terminals(client_socket)
-    
-    def _register_terminal(self, message: dict, client_socket):
+        handler = self._handlers.get(message.get('type'))
+        if handler:
+            handler(message, peer)
+    
+    def _register_terminal(self, message: dict, peer):
         """Register a new terminal"""
         term_name = message.get('name')
         if term_name:
             self.terminals[term_name] = {
-                'socket': client_socket,
+                'peer': peer,
                 'pid': message.get('pid'),
                 'cwd': message.get('cwd', os.getcwd())
             }
-            response = {'status': 'registered', 'name': term_name}
-            client_socket.send(json.dumps(response).encode())
+            peer.names.add(term_name)
+            self.terminals_version = next(self._versions)
+            peer.send(_encode_registered(term_name, peer.codec))
     
-    def _send_to_terminal(self, message: dict):
+    def _unregister_terminal(self, name: str, peer):
+        """Forget a terminal, unless it has since re-registered elsewhere"""
+        if self.terminals.pop_if(name, lambda entry: entry['peer'] is peer):
+            self.terminals_version = next(self._versions)
+    
+    def _send_to_terminal(self, message: dict, peer):
         """Send message to specific terminal"""
         target = message.get('target')
         content = message.get('content')
         
-        if target in self.terminals:
-            target_socket = self.terminals[target]['socket']
-            msg = {'type': 'message', 'content': content}
+        entry = self.terminals.get(target)
+        if entry:
+            peer = entry['peer']
             try:
-                target_socket.send(json.dumps(msg).encode())
+                peer.send(_encode_text_message(content, peer.codec))
             except:
                 # Terminal disconnected
-                del self.terminals[target]
+                self._unregister_terminal(target, peer)
     
-    def _execute_command(self, message: dict):
+    def _execute_command(self, message: dict, peer):
         """Execute command in target terminal"""
         target = message.get('target')
         command = message.get('command')
         callback_terminal = message.get('callback')
         
-        if target in self.terminals:
-            target_socket = self.terminals[target]['socket']
+        entry = self.terminals.get(target)
+        if entry:
             msg = {
                 'type': 'execute',
                 'command': command,
@@ -173,53 +594,125 @@ class TerminalManager:
                 self.completion_callbacks[f"{target}:{command}"] = callback_terminal
             
             try:
-                target_socket.send(json.dumps(msg).encode())
+                self._send_message(entry['peer'], msg)
             except:
-                del self.terminals[target]
+                self._unregister_terminal(target, entry['peer'])
     
-    def _handle_completion(self, message: dict):
+    def _handle_completion(self, message: dict, peer):
         """Handle task completion notifications"""
         terminal = message.get('terminal')
         command = message.get('command')
         result = message.get('result')
         
-        callback_key = f"{terminal}:{command}"
-        if callback_key in self.completion_callbacks:
-            callback_terminal = self.completion_callbacks[callback_key]
-            if callback_terminal in self.terminals:
-                callback_socket = self.terminals[callback_terminal]['socket']
+        # Popping first guarantees a callback is delivered at most once
+        callback_terminal = self.completion_callbacks.pop(f"{terminal}:{command}")
+        if callback_terminal:
+            entry = self.terminals.get(callback_terminal)
+            if entry:
                 msg = {
                     'type': 'callback',
                     'from_terminal': terminal,
                     'command': command,
                     'result': result
                 }
-                try:
-                    callback_socket.send(json.dumps(msg).encode())
-                except:
-                    pass
-            del self.completion_callbacks[callback_key]
+                self._queue_callback(entry['peer'], msg)
+    
+    def _queue_callback(self, peer: _Peer, msg: dict):
+        """Queue a callback or stream relay, arming a flush on the peer's loop if needed"""
+        with self._pending_lock:
+            pending = self._pending_callbacks.setdefault(peer, [])
+            pending.append(msg)
+            first = len(pending) == 1
+        if first:
+            try:
+                peer.loop.call_soon_threadsafe(
+                    peer.loop.call_later, CALLBACK_BATCH_WINDOW, self._flush_callbacks, peer
+                )
+            except RuntimeError:
+                # Loop already finished
+                with self._pending_lock:
+                    self._pending_callbacks.pop(peer, None)
     
-    def _list_terminals(self, client_socket):
+    def _flush_callbacks(self, peer: _Peer):
+        """Send every queued message for a peer in one message, in order"""
+        with self._pending_lock:
+            items = self._pending_callbacks.pop(peer, [])
+        if not items:
+            return
+        msg = items[0] if len(items) == 1 else {'type': 'batch', 'items': items}
+        try:
+            self._send_message(peer, msg)
+        except:
+            pass
+    
+    def _handle_stream(self, message: dict, peer):
+        """Forward partial command output to the callback terminal"""
+        terminal = message.get('terminal')
+        command = message.get('command')
+        
+        callback_terminal = self.completion_callbacks.get(f"{terminal}:{command}")
+        if callback_terminal:
+            entry = self.terminals.get(callback_terminal)
+            if entry:
+                msg = {
+                    'type': 'stream',
+                    'from_terminal': terminal,
+                    'command': command,
+                    'stream': message.get('stream'),
+                    'data': message.get('data'),
+                    'encoding': message.get('encoding')
+                }
+                # Shares the callback queue so output never overtakes the
+                # completion of an earlier command
+                self._queue_callback(entry['peer'], msg)
+    
+    def _list_terminals(self, message: dict, peer):
         """List active terminals"""
-        terminal_list = list(self.terminals.keys())
-        response = {'type': 'list', 'terminals': terminal_list}
-        client_socket.send(json.dumps(response).encode())
+        # Read the version before the keys so a concurrent change can only
+        # leave the cache looking stale, never fresh.
+        version = self.terminals_version
+        cached = self._list_cache.get(peer.codec)
+        if cached and cached[0] == version:
+            payload = cached[1]
+        else:
+            response = {'type': 'list', 'terminals': self.terminals.keys()}
+            payload = _encode_message(response, peer.codec)
+            self._list_cache[peer.codec] = (version, payload)
+        peer.send(payload)
 
 class PipelineTerminal:
     """Individual terminal instance with Pipeline integration"""
     
-    def __init__(self, name: str, port: int):
+    def __init__(self, name: str, port: int, socket_options: Optional[List[tuple]] = None):
         self.name = name
         self.port = port
         self.socket = None
-        self.running = True
+        self.socket_options = socket_options
+        self.send_lock = threading.Lock()
         self.config = PipelineConfig()
+        self.control_path = self.config.control_path(name)
+        self.control_socket = None
+        self.list_waiters = collections.deque()
+        # Received commands run one at a time off the listener thread, so
+        # replies keep arriving while a long command runs
+        self.commands = queue.Queue()
+        # Self-pipe: closing the write end wakes the control listener
+        self._shutdown_r, self._shutdown_w = socket.socketpair()
+        self.running = True
+        self._handlers = {
+            'message': self._handle_text_message,
+            'execute': self.commands.put,
+            'callback': self._handle_callback,
+            'stream': self._handle_stream,
+            'list': self._handle_list,
+            'batch': self._handle_batch
+        }
         
     def connect(self):
         """Connect to Pipeline server"""
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            _apply_socket_options(self.socket, self.socket_options)
             self.socket.connect(('localhost', self.port))
             
             # Register this terminal
@@ -229,41 +722,147 @@ class PipelineTerminal:
                 'pid': os.getpid(),
                 'cwd': os.getcwd()
             }
-            self.socket.send(json.dumps(register_msg).encode())
+            self._send(register_msg)
             
             # Start message listener
             listener_thread = threading.Thread(target=self._listen_for_messages)
             listener_thread.daemon = True
             listener_thread.start()
             
+            command_thread = threading.Thread(target=self._run_received_commands)
+            command_thread.daemon = True
+            command_thread.start()
+            
+            self._start_control_server()
             return True
         except Exception as e:
             print(f"Failed to connect to Pipeline server: {e}")
             return False
     
-    def _listen_for_messages(self):
-        """Listen for incoming messages"""
+    def disconnect(self):
+        """Stop listening and close the connection to the server"""
+        self.running = False
+        self.commands.put(None)
+        self._shutdown_w.close()
+        if self.socket:
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.socket.close()
+    
+    def _start_control_server(self):
+        """Serve the psend/pexec/plist shell helpers over a UNIX socket"""
+        if not hasattr(socket, 'AF_UNIX'):
+            return
+        try:
+            if os.path.exists(self.control_path):
+                os.unlink(self.control_path)
+            self.control_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.control_socket.bind(self.control_path)
+            os.chmod(self.control_path, 0o600)
+            self.control_socket.listen(10)
+        except OSError as e:
+            print(f"Pipeline shell commands unavailable: {e}")
+            return
+        
+        control_thread = threading.Thread(target=self._handle_control_connections)
+        control_thread.daemon = True
+        control_thread.start()
+    
+    def _handle_control_connections(self):
+        """Accept connections from the shell helpers"""
         while self.running:
             try:
-                data = self.socket.recv(4096)
-                if not data:
+                ready, _, _ = select.select([self.control_socket, self._shutdown_r], [], [])
+                if self._shutdown_r in ready:
                     break
-                
-                message = json.loads(data.decode())
-                self._handle_message(message)
+                conn, _ = self.control_socket.accept()
+            except:
+                break
+            # Requests are handled inline, so a helper that stalls
+            # must not hold up the ones behind it
+            conn.settimeout(2.0)
+            try:
+                with conn:
+                    self._handle_control_request(conn)
+            except OSError:
+                continue
             except:
                 break
+        self.control_socket.close()
+        try:
+            os.unlink(self.control_path)
+        except OSError:
+            pass
+    
+    def _handle_control_request(self, conn: socket.socket):
+        """Run one tab-separated request, terminated by EOF
+        
+        Requests are ``send TARGET CONTENT``, ``exec TARGET FLAG COMMAND``
+        and ``list``.
+        """
+        data = bytearray()
+        while True:
+            chunk = conn.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+        action, _, args = data.decode(errors='replace').rstrip('\n').partition('\t')
+        
+        if action == 'send':
+            target, _, content = args.partition('\t')
+            self.send_to_terminal(target, content)
+        elif action == 'exec':
+            target, flag, command = (args.split('\t', 2) + ['', ''])[:3]
+            self.execute_in_terminal(target, command, callback=flag == '--callback')
+        elif action == 'list':
+            reply = queue.Queue(maxsize=1)
+            self.list_waiters.append(reply)
+            self.list_terminals()
+            try:
+                terminals = reply.get(timeout=2.0)
+            except queue.Empty:
+                conn.sendall(b"Error: no reply from Pipeline server\n")
+                return
+            conn.sendall(f"Active terminals: {', '.join(terminals)}\n".encode())
+    
+    def _send(self, message: dict):
+        """Send a message to the server; safe to call from any thread"""
+        payload = _encode_message(message)
+        with self.send_lock:
+            _send_frame(self.socket, payload)
+    
+    def _listen_for_messages(self):
+        """Listen for incoming messages"""
+        try:
+            for data in _read_frames(self.socket):
+                if not self.running:
+                    break
+                message, _ = _decode_message(data)
+                self._handle_message(message)
+        except:
+            pass
     
     def _handle_message(self, message: dict):
         """Handle incoming messages"""
-        msg_type = message.get('type')
-        
-        if msg_type == 'message':
-            print(f"\n[Pipeline Message]: {message.get('content')}")
-        elif msg_type == 'execute':
+        handler = self._handlers.get(message.get('type'))
+        if handler:
+            handler(message)
+    
+    def _handle_batch(self, message: dict):
+        """Handle each message of a batch in order"""
+        for item in message.get('items', []):
+            self._handle_message(item)
+    
+    def _handle_text_message(self, message: dict):
+        """Print a message sent by another terminal"""
+        print(f"\n[Pipeline Message]: {message.get('content')}")
+    
+    def _run_received_commands(self):
+        """Execute queued commands in the order they arrived"""
+        for message in iter(self.commands.get, None):
             self._execute_received_command(message)
-        elif msg_type == 'callback':
-            self._handle_callback(message)
     
     def _execute_received_command(self, message: dict):
         """Execute command received from another terminal"""
@@ -272,33 +871,82 @@ class PipelineTerminal:
         
         print(f"\n[Pipeline Execute]: {command}")
         
+        import subprocess
+        streams = ['stdout', 'stderr']
+        error = ''
         try:
-            result = subprocess.run(
-                command, 
-                shell=True, 
-                capture_output=True, 
-                text=True
-            )
+            # Output stays as bytes; it is only decoded once, for the wire
+            popen_kwargs = {
+                'stdout': subprocess.PIPE,
+                'stderr': subprocess.PIPE
+            }
+            try:
+                process = subprocess.Popen(_command_args(command), **popen_kwargs)
+            except FileNotFoundError:
+                # Shell builtins such as cd or export
+                process = subprocess.Popen(['/bin/sh', '-c', command], **popen_kwargs)
             
-            output = result.stdout if result.returncode == 0 else result.stderr
-            print(output)
+            # Both pipes are drained by their own reader; this thread is
+            # the only consumer, so it alone prints and sends. Lines are
+            # streamed as they arrive rather than kept for the completion.
+            output = queue.Queue()
+            for producer, pipe in enumerate([process.stdout, process.stderr]):
+                reader = threading.Thread(target=self._read_output, args=(pipe, output, producer))
+                reader.daemon = True
+                reader.start()
             
-            # Send completion notification if callback requested
-            if callback:
-                completion_msg = {
-                    'type': 'complete',
-                    'terminal': self.name,
-                    'command': command,
-                    'result': {
-                        'returncode': result.returncode,
-                        'stdout': result.stdout,
-                        'stderr': result.stderr
-                    }
-                }
-                self.socket.send(json.dumps(completion_msg).encode())
-                
+            open_pipes = len(streams)
+            while open_pipes:
+                producer, line = output.get()
+                if line is None:
+                    open_pipes -= 1
+                    continue
+                stream = streams[producer]
+                _echo_output(line)
+                if callback:
+                    (data,), encoding = _encode_output(line)
+                    try:
+                        self._send({
+                            'type': 'stream',
+                            'terminal': self.name,
+                            'command': command,
+                            'stream': stream,
+                            'data': data,
+                            'encoding': encoding
+                        })
+                    except OSError:
+                        callback = None
+            returncode = process.wait()
         except Exception as e:
             print(f"Error executing command: {e}")
+            # Same code the shell uses for a command it cannot execute
+            returncode = 126 if isinstance(e, PermissionError) else 1
+            error = f"{e}\n"
+        
+        # Send completion notification if callback requested, even when
+        # the command could not be started
+        if callback:
+            completion_msg = {
+                'type': 'complete',
+                'terminal': self.name,
+                'command': command,
+                'result': {
+                    'returncode': returncode,
+                    'stderr': error,
+                    'encoding': 'utf8'
+                }
+            }
+            try:
+                self._send(completion_msg)
+            except OSError:
+                pass
+    
+    def _read_output(self, pipe, output: queue.Queue, producer: int):
+        """Queue a pipe's lines, followed by None once it closes"""
+        for line in iter(pipe.readline, b''):
+            output.put((producer, line))
+        pipe.close()
+        output.put((producer, None))
     
     def _handle_callback(self, message: dict):
         """Handle completion callbacks"""
@@ -309,10 +957,25 @@ class PipelineTerminal:
         print(f"\n[Pipeline Callback from {from_terminal}]:")
         print(f"Command: {command}")
         print(f"Return code: {result.get('returncode')}")
+        encoding = result.get('encoding')
         if result.get('stdout'):
-            print(f"Output: {result.get('stdout')}")
+            print(f"Output: {_decode_output(result.get('stdout'), encoding)}")
         if result.get('stderr'):
-            print(f"Error: {result.get('stderr')}")
+            print(f"Error: {_decode_output(result.get('stderr'), encoding)}")
+    
+    def _handle_stream(self, message: dict):
+        """Handle output streamed by a command running elsewhere"""
+        from_terminal = message.get('from_terminal')
+        data = _decode_output(message.get('data'), message.get('encoding'))
+        print(f"[Pipeline Output from {from_terminal}]: {data}", end='')
+    
+    def _handle_list(self, message: dict):
+        """Hand a terminal list to the waiting shell helper, or print it"""
+        terminals = message.get('terminals', [])
+        try:
+            self.list_waiters.popleft().put(terminals)
+        except IndexError:
+            print(f"\nActive terminals: {', '.join(terminals)}")
     
     def send_to_terminal(self, target: str, content: str):
         """Send message to another terminal"""
@@ -322,7 +985,7 @@ class PipelineTerminal:
                 'target': target,
                 'content': content
             }
-            self.socket.send(json.dumps(msg).encode())
+            self._send(msg)
     
     def execute_in_terminal(self, target: str, command: str, callback: bool = False):
         """Execute command in another terminal"""
@@ -333,13 +996,13 @@ class PipelineTerminal:
                 'command': command,
                 'callback': self.name if callback else None
             }
-            self.socket.send(json.dumps(msg).encode())
+            self._send(msg)
     
     def list_terminals(self):
         """List all active terminals"""
         if self.socket:
             msg = {'type': 'list'}
-            self.socket.send(json.dumps(msg).encode())
+            self._send(msg)
 
 def start_pipeline_server(port: int = 9999):
     """Start the Pipeline server"""
@@ -349,107 +1012,125 @@ def start_pipeline_server(port: int = 9999):
         return False
     
     print("Pipeline server is running. Press Ctrl+C to stop.")
-    
-    try:
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        print("\nShutting down Pipeline server...")
-        manager.running = False
-        if manager.server_socket:
-            manager.server_socket.close()
+    manager.serve_forever()
+    print("\nShutting down Pipeline server...")
     
     return True
 
-def create_mosaic_terminal(name: str, port: int = 9999):
-    """Create a new Mosaic terminal window with Pipeline integration"""
-    script_content = f'''#!/bin/bash
-export PIPELINE_NAME="{name}"
-export PIPELINE_PORT="{port}"
+# Launcher script for a Mosaic terminal. Bash's own variables are left
+# alone by safe_substitute; only $NAME, $PORT, $PYPATH and $CONTROL are
+# filled in.
+_MOSAIC_SCRIPT = string.Template(r'''#!/bin/bash
+export PIPELINE_NAME="$NAME"
+export PIPELINE_PORT="$PORT"
+export PIPELINE_CONTROL="$CONTROL"
 
-# Start Pipeline terminal integration
+# Keep a Pipeline terminal connected for the lifetime of this shell; it
+# also serves the psend/pexec/plist helpers over $PIPELINE_CONTROL
 python3 -c "
-import sys
-sys.path.append('{os.path.dirname(os.path.abspath(__file__))}')
+import sys, threading
+sys.path.append('$PYPATH')
 from pipeline import PipelineTerminal
-import os
-import subprocess
-import threading
 
-terminal = PipelineTerminal('{name}', {port})
+terminal = PipelineTerminal('$NAME', $PORT)
 if terminal.connect():
-    print(f'Pipeline terminal \"{name}\" connected')
-    
-    # Add Pipeline commands to bash
-    pipeline_commands = """
-    
-    # Pipeline command functions
-    psend() {{
-        python3 -c \"
-import socket, json
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-s.connect(('localhost', {port}))
-msg = {{'type': 'send', 'target': '$1', 'content': '$2'}}
-s.send(json.dumps(msg).encode())
-s.close()
-\"
-    }}
-    
-    pexec() {{
-        callback_flag=\"\"
-        if [[ \"$3\" == \"--callback\" ]]; then
-            callback_flag=\"'{name}'\"
-        fi
-        python3 -c \"
-import socket, json
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-s.connect(('localhost', {port}))
-msg = {{'type': 'execute', 'target': '$1', 'command': '$2', 'callback': $callback_flag}}
-s.send(json.dumps(msg).encode())
-s.close()
-\"
-    }}
-    
-    plist() {{
-        python3 -c \"
-import socket, json
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-s.connect(('localhost', {port}))
-msg = {{'type': 'list'}}
-s.send(json.dumps(msg).encode())
-response = s.recv(4096)
-data = json.loads(response.decode())
-print('Active terminals:', ', '.join(data.get('terminals', [])))
-s.close()
-\"
-    }}
-    """
-    
-    echo \"$pipeline_commands\" >> ~/.bashrc
-    source ~/.bashrc
+    print('Pipeline terminal \"$NAME\" connected')
+    threading.Event().wait()
 else:
-    echo 'Failed to connect to Pipeline server'
-fi
-"
+    sys.exit(1)
+" &
+PIPELINE_PID=$!
+
+rcfile=$(mktemp "${TMPDIR:-/tmp}/pipeline_$NAME.XXXXXX") || exit 1
+cat > "$rcfile" <<'PIPELINE_RC'
+[ -f ~/.bashrc ] && . ~/.bashrc
+
+# Pipeline command functions: one tab-separated request per connection
+_pipeline_ctl() {
+    if command -v socat >/dev/null 2>&1; then
+        socat - UNIX-CONNECT:"$PIPELINE_CONTROL"
+    else
+        python3 -S -c "
+import socket, sys
+s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+s.connect(sys.argv[1])
+s.sendall(sys.stdin.buffer.read())
+s.shutdown(socket.SHUT_WR)
+sys.stdout.write(s.makefile().read())
+" "$PIPELINE_CONTROL"
+    fi
+}
+
+psend() {
+    printf 'send\t%s\t%s\n' "$1" "$2" | _pipeline_ctl
+}
+
+pexec() {
+    printf 'exec\t%s\t%s\t%s\n' "$1" "$3" "$2" | _pipeline_ctl
+}
+
+plist() {
+    printf 'list\n' | _pipeline_ctl
+}
+PIPELINE_RC
 
 # Start bash with Pipeline integration
-exec bash --rcfile <(echo '. ~/.bashrc')
-'''
+bash --rcfile "$rcfile"
+rm -f "$rcfile"
+kill "$PIPELINE_PID" 2>/dev/null
+''')
+
+def _is_trusted_script(path: Path, content: str) -> bool:
+    """Whether an existing launcher is ours, private and unchanged"""
+    try:
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if st.st_uid != os.getuid() or st.st_mode & 0o022:
+                return False
+            return f.read() == content.encode()
+    except OSError:
+        return False
 
-    script_path = f"/tmp/pipeline_{name}.sh"
-    with open(script_path, 'w') as f:
-        f.write(script_content)
+def create_mosaic_terminal(name: str, port: int = 9999):
+    """Create a new Mosaic terminal window with Pipeline integration"""
+    config = PipelineConfig()
+    script_content = _MOSAIC_SCRIPT.safe_substitute(
+        NAME=name,
+        PORT=port,
+        PYPATH=os.path.dirname(os.path.abspath(__file__)),
+        CONTROL=config.control_path(name)
+    )
     
-    os.chmod(script_path, 0o755)
+    # Scripts are keyed by content, so relaunching the same terminal
+    # reuses the file already on disk, but only if nobody else could
+    # have written it
+    launcher_dir = config.config_dir / 'launchers'
+    launcher_dir.mkdir(mode=0o700, exist_ok=True)
+    import hashlib
+    digest = hashlib.sha1(script_content.encode()).hexdigest()[:16]
+    script_path = launcher_dir / f"{digest}.sh"
+    if not _is_trusted_script(script_path, script_content):
+        import tempfile
+        fd, tmp_path = tempfile.mkstemp(dir=launcher_dir, prefix=f".{digest}.")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                os.fchmod(f.fileno(), 0o700)
+                f.write(script_content)
+            os.replace(tmp_path, script_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
     
     # Launch Mosaic terminal
+    import subprocess
     subprocess.Popen([
         'mosaic', 
         '--terminal-title', f'Pipeline: {name}',
-        '--exec', script_path
+        '--exec', str(script_path)
     ])
 
 def main():
+    import argparse
     parser = argparse.ArgumentParser(description='Pipeline - Advanced Terminal Multiplexer')
     parser.add_argument('command', nargs='?', help='Command to execute')
     parser.add_argument('name', nargs='?', help='Terminal name')